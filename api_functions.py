@@ -1,12 +1,17 @@
 from uuid import uuid4
 
+from camera_calibration import load_camera_profile, get_focal_length, get_camera_matrix
+from image_processing import get_original_size
+from calculate_location import DroneGlobalTracker
 from integration import get_object_center, get_updated_location
-from location_computing import lla_to_ecef, lla_to_xyz, tuple_multiply
+from location_computing import lla_to_ecef, lla_to_xyz, tuple_multiply, CAMERA_FOCAL_LENGTH_MM
+from trajectory_store import TrajectoryStore
 
 
 flying_sessions = {}
 
-def open_flying_session(starting_location, drone_width_cm, first_frame):
+def open_flying_session(starting_location, drone_width_cm, first_frame, timestamp=None, camera_profile=None,
+                        return_detection=False):
     """
     Simulate opening a flying session with given starting location and focal length.
     
@@ -14,28 +19,60 @@ def open_flying_session(starting_location, drone_width_cm, first_frame):
         starting_location (tuple): (long, lat, alt)
         drone_width_cm (float): Width of the drone in cm
         first_frame (PIL Image): First frame of the session
+        timestamp (float): Timestamp of the first frame; recorded in the trajectory if given
+        camera_profile (str): Name of a calibrated camera profile; defaults to CAMERA_FOCAL_LENGTH_MM
+        return_detection (bool): Also return the first frame's detection dict (or None)
 
     Returns:
-        str: Session id
+        tuple: Session id and the starting center (or None if nothing was detected)
     """
 
+    # Camera constants are resolved once per session, for the session's frame size
+    image_size = get_original_size(first_frame)
+    if camera_profile is not None:
+        profile = load_camera_profile(camera_profile)
+        focal_length = get_focal_length(profile, image_size)
+        camera_matrix = get_camera_matrix(profile, image_size)
+    else:
+        focal_length = CAMERA_FOCAL_LENGTH_MM
+        camera_matrix = get_camera_matrix(
+            {'K': [[focal_length, 0, image_size[0] / 2], [0, focal_length, image_size[1] / 2], [0, 0, 1]]}
+        )
+
     session_id = uuid4().hex
 
-    starting_center = get_object_center(first_frame)
+    starting_center, first_detection = get_object_center(first_frame, return_detection=True)
+
+    trajectory = TrajectoryStore(session_id)
+    if timestamp is not None:
+        try:
+            trajectory.append(timestamp, starting_location)
+        except (TypeError, ValueError) as e:
+            print(f"Trajectory not recorded: {e}")
 
     current_flying_session = {
         'starting_location_xyz': starting_location,
         'starting_center': starting_center,
-        'drone_width_cm': drone_width_cm
+        'drone_width_cm': drone_width_cm,
+        'object_width_mm': drone_width_cm * 10,  # Convert cm to mm
+        'camera_profile': camera_profile,
+        'focal_length': focal_length,
+        'camera_matrix': camera_matrix,  # K for DroneGlobalTracker (see get_global_tracker)
+        'trajectory': trajectory,
+        # Track seed for the detection cascade
+        'last_box': None if first_detection is None else first_detection['box']
     }
 
     flying_sessions[session_id] = current_flying_session
 
-    print(f"Flying session opened at location {starting_location} with drone width {drone_width_cm} cm")
+    print(f"Flying session opened at location {starting_location} with drone width {drone_width_cm} cm, "
+          f"focal length {focal_length:.2f} px")
+    if return_detection:
+        return session_id, starting_center, first_detection
     return session_id, starting_center
 
 
-def update_flying_session(session_id, frame, timestamp):
+def update_flying_session(session_id, frame, timestamp, return_detection=False):
     """
     Update flying session with new frame, compute updated location.
     
@@ -43,9 +80,10 @@ def update_flying_session(session_id, frame, timestamp):
         session_id (str): Session identifier
         frame (PIL Image): Current frame
         timestamp (float): Timestamp of the frame
+        return_detection (bool): Also return the detection dict (or None)
     
     Returns:
-        tuple: Updated location (x, y, z) in mm or None if detection failed
+        tuple: Updated location (x, y, z) in mm or None if detection failed, and the timestamp
     """
     if session_id not in flying_sessions:
         print(f"Session ID {session_id} not found")
@@ -55,13 +93,74 @@ def update_flying_session(session_id, frame, timestamp):
     session = flying_sessions[session_id]
     starting_location = session['starting_location_xyz']
     starting_center = session['starting_center']
-    drone_width_cm = session['drone_width_cm']
-    object_width_mm = drone_width_cm * 10  # Convert cm to mm
+    object_width_mm = session['object_width_mm']
 
-    updated_location = get_updated_location(frame, starting_location, object_width_mm, starting_center)
+    updated_location, detection = get_updated_location(
+        frame, starting_location, object_width_mm, starting_center, return_detection=True,
+        focal_length=session['focal_length'], track_box=session.get('last_box')
+    )
     if updated_location is not None:
+        session['last_box'] = detection['box']
         print(f"Updated location: {updated_location}")
+        try:
+            session['trajectory'].append(timestamp, updated_location, detection['score'], detection['box'])
+        except (TypeError, ValueError) as e:
+            print(f"Trajectory not recorded: {e}")
     else:
         print("Object detection failed; location not updated.")
 
-    return updated_location, timestamp
\ No newline at end of file
+    if return_detection:
+        return updated_location, timestamp, detection
+    return updated_location, timestamp
+
+
+def get_global_tracker(session_id, drone_height_cm=None):
+    """
+    Get a DroneGlobalTracker built from the session's camera matrix, creating it once.
+
+    Args:
+        session_id (str): Session identifier
+        drone_height_cm (float): Height of the drone in cm; defaults to its width
+
+    Returns:
+        DroneGlobalTracker: The session's tracker, or None if the session is unknown
+    """
+    session = flying_sessions.get(session_id)
+    if session is None:
+        return None
+    if 'global_tracker' not in session:
+        drone_w = session['drone_width_cm'] / 100  # tracker works in meters
+        drone_h = drone_w if drone_height_cm is None else drone_height_cm / 100
+        session['global_tracker'] = DroneGlobalTracker.from_camera_profile(drone_w, drone_h, session['camera_matrix'])
+    return session['global_tracker']
+
+
+def get_trajectory_store(session_id):
+    """
+    Get the trajectory store of a session, reopening it read-only from disk for past sessions.
+
+    Args:
+        session_id (str): Session identifier
+
+    Returns:
+        TrajectoryStore: The session's store, or None if the session is unknown
+    """
+    if session_id in flying_sessions:
+        return flying_sessions[session_id]['trajectory']
+    if TrajectoryStore.exists(session_id):
+        return TrajectoryStore(session_id, read_only=True)
+    return None
+
+
+def close_flying_session(session_id):
+    """
+    Close a flying session and its trajectory file; its trajectory stays queryable from disk.
+
+    Args:
+        session_id (str): Session identifier
+    """
+    session = flying_sessions.pop(session_id, None)
+    if session is None:
+        return
+    session['trajectory'].close()
+    print(f"Flying session {session_id} closed")
\ No newline at end of file
@@ -4,18 +4,21 @@ import math
 
 
 class DroneGlobalTracker:
-    def __init__(self, drone_w, drone_h, focal_mm, sensor_w_mm, img_w, img_h):
+    def __init__(self, drone_w, drone_h, focal_mm, sensor_w_mm, img_w, img_h, camera_matrix=None):
         # נתוני רחפן ומצלמה
         self.real_w = drone_w
         self.real_h = drone_h
 
-        # חישוב מטריצת מצלמה (K)
-        f_px = (focal_mm / sensor_w_mm) * img_w
-        self.K = np.array([
-            [f_px, 0, img_w / 2],
-            [0, f_px, img_h / 2],
-            [0, 0, 1]
-        ], dtype=np.float32)
+        # חישוב מטריצת מצלמה (K), או שימוש במטריצה מכיול (camera_calibration)
+        if camera_matrix is not None:
+            self.K = np.array(camera_matrix, dtype=np.float32)
+        else:
+            f_px = (focal_mm / sensor_w_mm) * img_w
+            self.K = np.array([
+                [f_px, 0, img_w / 2],
+                [0, f_px, img_h / 2],
+                [0, 0, 1]
+            ], dtype=np.float32)
 
         # מודל רחפן בתלת-ממד
         self.obj_points = np.array([
@@ -27,6 +30,11 @@ class DroneGlobalTracker:
 
         self.home_tvec = None
 
+    @classmethod
+    def from_camera_profile(cls, drone_w, drone_h, camera_matrix):
+        """Build a tracker from a calibrated K (see camera_calibration.get_camera_matrix)."""
+        return cls(drone_w, drone_h, None, None, None, None, camera_matrix=camera_matrix)
+
     def get_global_fix(self, pixel_points, lat_start, lon_start, azimuth_deg):
         """
         pixel_points: 4 נקודות [x,y] מהעיבוד
@@ -0,0 +1,269 @@
+import argparse
+import csv
+import glob
+import json
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from location_computing import get_bounding_box_width_pixels
+
+# Named camera profiles, shared by calibration runs and flying sessions
+CAMERA_PROFILES_PATH = "camera_profiles.json"
+
+_profiles_cache = {}  # path -> (mtime, profiles)
+
+
+def _read_camera_profiles(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_camera_profiles(path=CAMERA_PROFILES_PATH):
+    """
+    Load all camera profiles, re-reading the profiles file only when it has changed.
+
+    Args:
+        path (str): Profiles JSON file
+
+    Returns:
+        dict: profile name -> profile dict
+    """
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    cached = _profiles_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, _read_camera_profiles(path))
+        _profiles_cache[path] = cached
+    return cached[1]
+
+
+def load_camera_profile(name, path=CAMERA_PROFILES_PATH):
+    """
+    Get a named camera profile.
+
+    Args:
+        name (str): Profile name
+        path (str): Profiles JSON file
+
+    Returns:
+        dict: {'focal_length_px', 'image_size', 'K', 'dist_coeffs', 'source', 'rms_error'}
+    """
+    profiles = load_camera_profiles(path)
+    if name not in profiles:
+        raise ValueError(f"Unknown camera profile {name}; known profiles: {sorted(profiles)}")
+    return profiles[name]
+
+
+def save_camera_profile(name, profile, path=CAMERA_PROFILES_PATH):
+    """
+    Add or replace a named camera profile and write the profiles file.
+
+    Args:
+        name (str): Profile name
+        profile (dict): Profile as returned by the calibrate_* functions
+        path (str): Profiles JSON file
+    """
+    # Re-read so profiles saved by another process since our last load are kept
+    profiles = dict(_read_camera_profiles(path))
+    profiles[name] = profile
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(tmp_path, path)
+    _profiles_cache[path] = (os.path.getmtime(path), profiles)
+    print(f"Saved camera profile {name} to {path}")
+
+
+def get_focal_length(profile, image_size=None):
+    """
+    Focal length in pixels for frames of the given size.
+
+    The profile's focal length is scaled when frames have a different width than the
+    calibration images (same camera, different capture resolution).
+
+    Args:
+        profile (dict): Camera profile
+        image_size (tuple): (width, height) of the frames, or None for the calibration size
+
+    Returns:
+        float: Focal length in pixels
+    """
+    if image_size is None:
+        return profile['focal_length_px']
+    return profile['focal_length_px'] * image_size[0] / profile['image_size'][0]
+
+
+def get_camera_matrix(profile, image_size=None):
+    """
+    Camera matrix K for frames of the given size.
+
+    Args:
+        profile (dict): Camera profile
+        image_size (tuple): (width, height) of the frames, or None for the calibration size
+
+    Returns:
+        np.ndarray: 3x3 float32 matrix
+    """
+    K = np.array(profile['K'], dtype=np.float32)
+    if image_size is not None:
+        K[:2] *= image_size[0] / profile['image_size'][0]
+    return K
+
+
+def solve_focal_length(pixel_widths, real_width, distances):
+    """
+    Least-squares focal length from many (pixel width, distance) observations.
+
+    Solves pixel_width_i = f * real_width / distance_i for f over all frames at once.
+
+    Args:
+        pixel_widths (array-like): Object widths in pixels
+        real_width (float): Real object width in millimeters
+        distances (array-like): Known distances in millimeters
+
+    Returns:
+        tuple: (focal length in pixels, RMS residual in pixels)
+    """
+    pixel_widths = np.asarray(pixel_widths, dtype=np.float64)
+    design = real_width / np.asarray(distances, dtype=np.float64)
+    focal_length = float(design @ pixel_widths / (design @ design))
+    rms = float(np.sqrt(np.mean((pixel_widths - focal_length * design) ** 2)))
+    return focal_length, rms
+
+
+def _profile_from_focal_length(focal_length, image_size, source, rms_error):
+    width, height = image_size
+    K = [[focal_length, 0.0, width / 2], [0.0, focal_length, height / 2], [0.0, 0.0, 1.0]]
+    return {
+        'focal_length_px': focal_length,
+        'image_size': [width, height],
+        'K': K,
+        'dist_coeffs': None,
+        'source': source,
+        'rms_error': rms_error,
+    }
+
+
+def calibrate_from_distances(samples, real_width, batch_size=4):
+    """
+    Calibrate from frames of the object at known distances.
+
+    Args:
+        samples (list): (image_path, distance_mm) pairs
+        real_width (float): Real object width in millimeters
+        batch_size (int): Number of images per model forward pass
+
+    Returns:
+        dict: Camera profile
+    """
+    # Imported here so chessboard calibration does not need to load the detector
+    from integration import detect_objects_in_images, TEXT_PROMPT, processor, model
+
+    images = [Image.open(path).convert("RGB") for path, _ in samples]
+    detections = detect_objects_in_images(images, TEXT_PROMPT, processor, model, batch_size)
+
+    pixel_widths, distances = [], []
+    for (path, distance), detection in zip(samples, detections):
+        if detection is None:
+            print(f"No detection in {path}; skipped")
+            continue
+        pixel_widths.append(get_bounding_box_width_pixels(detection['box']))
+        distances.append(distance)
+    if not pixel_widths:
+        raise ValueError("No detections in calibration frames")
+
+    focal_length, rms = solve_focal_length(pixel_widths, real_width, distances)
+    print(f"Focal length: {focal_length:.2f} px from {len(pixel_widths)} frames (RMS {rms:.2f} px)")
+    return _profile_from_focal_length(focal_length, images[0].size, "distances", rms)
+
+
+def calibrate_from_chessboard(image_paths, pattern_size, square_mm):
+    """
+    Calibrate intrinsics from a chessboard image sequence with OpenCV.
+
+    Args:
+        image_paths (list): Chessboard images
+        pattern_size (tuple): Inner corners per row and column, e.g. (9, 6)
+        square_mm (float): Chessboard square size in millimeters
+
+    Returns:
+        dict: Camera profile
+    """
+    cols, rows = pattern_size
+    board = np.zeros((cols * rows, 3), np.float32)
+    board[:, :2] = np.mgrid[0:cols, 0:rows].T.reshape(-1, 2) * square_mm
+
+    object_points, image_points, image_size = [], [], None
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+    for path in image_paths:
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            print(f"Could not read {path}; skipped")
+            continue
+        image_size = gray.shape[::-1]
+        found, corners = cv2.findChessboardCorners(gray, pattern_size, None)
+        if not found:
+            print(f"No chessboard in {path}; skipped")
+            continue
+        object_points.append(board)
+        image_points.append(cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria))
+    if not object_points:
+        raise ValueError("No chessboard found in calibration frames")
+
+    rms, K, dist_coeffs, _, _ = cv2.calibrateCamera(object_points, image_points, image_size, None, None)
+    print(f"Calibrated from {len(object_points)} chessboard frames (RMS {rms:.3f} px)")
+    return {
+        'focal_length_px': float((K[0, 0] + K[1, 1]) / 2),
+        'image_size': list(image_size),
+        'K': K.tolist(),
+        'dist_coeffs': dist_coeffs.ravel().tolist(),
+        'source': "chessboard",
+        'rms_error': float(rms),
+    }
+
+
+def read_distance_samples(csv_path):
+    """
+    Read (image_path, distance_mm) rows from a CSV file; relative paths are resolved
+    against the CSV's folder.
+    """
+    folder = os.path.dirname(csv_path)
+    samples = []
+    with open(csv_path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                distance = float(row[1])
+            except ValueError:
+                continue  # header row
+            samples.append((os.path.join(folder, row[0]), distance))
+    return samples
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate a camera and save it as a named profile")
+    parser.add_argument("name", help="Camera profile name")
+    parser.add_argument("--distances", help="CSV of image_path,distance_mm rows of the object at known distances")
+    parser.add_argument("--object_width_mm", type=float, help="Real object width in mm (with --distances)")
+    parser.add_argument("--chessboard", help="Glob of chessboard images, e.g. 'calib/*.jpg'")
+    parser.add_argument("--pattern", default="9x6", help="Chessboard inner corners, COLSxROWS (default: 9x6)")
+    parser.add_argument("--square_mm", type=float, default=25.0, help="Chessboard square size in mm (default: 25)")
+
+    args = parser.parse_args()
+
+    if args.distances:
+        if args.object_width_mm is None:
+            parser.error("--object_width_mm is required with --distances")
+        profile = calibrate_from_distances(read_distance_samples(args.distances), args.object_width_mm)
+    elif args.chessboard:
+        pattern = tuple(int(v) for v in args.pattern.lower().split("x"))
+        profile = calibrate_from_chessboard(sorted(glob.glob(args.chessboard)), pattern, args.square_mm)
+    else:
+        parser.error("Give either --distances or --chessboard")
+
+    save_camera_profile(args.name, profile)
@@ -0,0 +1,300 @@
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import time
+
+from PIL import Image
+
+from image_processing import get_object_bounding_box, get_object_bounding_box_cascade, get_cascade_stats, decode_frame, MODEL_ID, TEXT_PROMPT, processor, model
+from integration import list_image_files as list_folder_images
+from location_computing import get_bounding_box_center, compute_distance_from_camera, compute_real_length, CAMERA_FOCAL_LENGTH_MM
+
+DEFAULT_FOLDERS = ["images", "output_folder"]
+DEFAULT_GOLDEN_PATH = "golden_detections.json"
+DEFAULT_OBJECT_WIDTH_MM = 320
+
+
+def reference_detect(image_bytes_list):
+    """Baseline path: full-size decode, then `get_object_bounding_box`."""
+    images = [Image.open(io.BytesIO(b)).convert("RGB") for b in image_bytes_list]
+    return get_object_bounding_box(images, TEXT_PROMPT, processor, model)
+
+
+def reduced_decode_detect(image_bytes_list):
+    """Reduced-resolution JPEG decode (`decode_frame`), then `get_object_bounding_box`."""
+    images = [decode_frame(b) for b in image_bytes_list]
+    return get_object_bounding_box(images, TEXT_PROMPT, processor, model)
+
+
+def tiled_detect(image_bytes_list):
+    """Full-resolution decode, then tiled detection with a coarse tile-selection pass."""
+    images = [decode_frame(b, reduce=False) for b in image_bytes_list]
+    return get_object_bounding_box(images, TEXT_PROMPT, processor, model, batch_size=4, tiled=True)
+
+
+def cascade_detect(image_bytes_list):
+    """Reduced-resolution decode, then the light -> base detection cascade."""
+    images = [decode_frame(b) for b in image_bytes_list]
+    return get_object_bounding_box_cascade(images, TEXT_PROMPT, processor, model)
+
+
+# Candidate configurations: name -> function(list of encoded images) -> list of detections
+CANDIDATES = {
+    "reduced_decode": reduced_decode_detect,
+    "tiled": tiled_detect,
+    "cascade": cascade_detect,
+}
+
+
+def list_evaluation_files(folders):
+    """
+    List image files in the given folders, sorted by filename within each folder.
+
+    Args:
+        folders (list): Folder paths
+
+    Returns:
+        list: File paths
+    """
+    paths = []
+    for folder in folders:
+        if not os.path.isdir(folder):
+            print(f"Skipping missing folder {folder}")
+            continue
+        paths.extend(os.path.join(folder, name) for name in list_folder_images(folder))
+    return paths
+
+
+def compute_iou(box_a, box_b):
+    """
+    Compute intersection-over-union of two boxes.
+
+    Args:
+        box_a (list): [x1, y1, x2, y2]
+        box_b (list): [x1, y1, x2, y2]
+
+    Returns:
+        float: IoU in [0, 1]
+    """
+    ix1, iy1 = max(box_a[0], box_b[0]), max(box_a[1], box_b[1])
+    ix2, iy2 = min(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+
+def compute_position(bbox, object_width_mm, focal_length):
+    """
+    Compute the object's camera-frame position (x, y, z) in mm from its bounding box.
+
+    Args:
+        bbox (list): [x1, y1, x2, y2]
+        object_width_mm (float): Real width of the object in millimeters
+        focal_length (float): Focal length in pixels
+
+    Returns:
+        tuple: (x, y, z) in mm
+    """
+    cx, cy = get_bounding_box_center(bbox)
+    distance_mm = compute_distance_from_camera(bbox, object_width_mm, focal_length)
+    return (compute_real_length(cx, distance_mm, focal_length),
+            compute_real_length(cy, distance_mm, focal_length),
+            distance_mm)
+
+
+def run_timed(detect_fn, paths):
+    """
+    Run a detection function over every file, one frame at a time.
+
+    Args:
+        detect_fn (callable): function(list of encoded images) -> list of detections
+        paths (list): Image file paths
+
+    Returns:
+        tuple: (detections, per-frame latencies in seconds)
+    """
+    detections = []
+    latencies = []
+    for path in paths:
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+        start_time = time.perf_counter()
+        detections.append(detect_fn([image_bytes])[0])
+        latencies.append(time.perf_counter() - start_time)
+    return detections, latencies
+
+
+def summarize_latency(latencies):
+    total = sum(latencies)
+    ordered = sorted(latencies)
+    return {
+        "mean_latency_s": total / len(latencies) if latencies else None,
+        "p95_latency_s": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else None,
+        "throughput_fps": len(latencies) / total if total > 0 else None,
+    }
+
+
+def hash_file(path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_or_create_golden(paths, golden_path, refresh=False):
+    """
+    Load reference detections from the golden file, or run the reference path and save them.
+
+    The golden file is reused only if it was produced by the current MODEL_ID and every
+    frame's content hash still matches.
+
+    Args:
+        paths (list): Image file paths
+        golden_path (str): Path of the golden JSON file
+        refresh (bool): Rerun the reference path even if the golden file exists
+
+    Returns:
+        dict: {'model_id', 'frames': {path: detection}, 'hashes': {path: sha256}, 'latency': {...}}
+    """
+    hashes = {p: hash_file(p) for p in paths}
+    if not refresh and os.path.exists(golden_path):
+        with open(golden_path) as f:
+            golden = json.load(f)
+        stale = [p for p in paths if p not in golden["frames"] or golden.get("hashes", {}).get(p) != hashes[p]]
+        if golden.get("model_id") != MODEL_ID:
+            print(f"{golden_path} was made with {golden.get('model_id')}, not {MODEL_ID}; rerunning reference")
+        elif stale:
+            print(f"{len(stale)} frames missing or changed in {golden_path}; rerunning reference")
+        else:
+            print(f"Loaded reference detections from {golden_path}")
+            return golden
+
+    print("Running reference path")
+    detections, latencies = run_timed(reference_detect, paths)
+    golden = {
+        "model_id": MODEL_ID,
+        "frames": dict(zip(paths, detections)),
+        "hashes": hashes,
+        "latency": summarize_latency(latencies),
+    }
+    with open(golden_path, "w") as f:
+        json.dump(golden, f, indent=2)
+    print(f"Saved reference detections to {golden_path}")
+    return golden
+
+
+def compare_detections(reference, candidate, object_width_mm, focal_length):
+    """
+    Compare candidate detections to the reference ones.
+
+    Args:
+        reference (list): Reference detections (dict or None per frame)
+        candidate (list): Candidate detections (dict or None per frame)
+        object_width_mm (float): Real width of the object in millimeters
+        focal_length (float): Focal length in pixels
+
+    Returns:
+        dict: Accuracy metrics
+    """
+    ious, center_errors, position_errors = [], [], []
+    missed, extra = 0, 0
+    for ref, cand in zip(reference, candidate):
+        if ref is None and cand is None:
+            continue
+        if cand is None:
+            missed += 1
+            continue
+        if ref is None:
+            extra += 1
+            continue
+
+        ious.append(compute_iou(ref['box'], cand['box']))
+        ref_center = get_bounding_box_center(ref['box'])
+        cand_center = get_bounding_box_center(cand['box'])
+        center_errors.append(math.dist(ref_center, cand_center))
+        position_errors.append(math.dist(
+            compute_position(ref['box'], object_width_mm, focal_length),
+            compute_position(cand['box'], object_width_mm, focal_length),
+        ))
+
+    def mean(values):
+        return sum(values) / len(values) if values else None
+
+    return {
+        "matched_frames": len(ious),
+        "missed_frames": missed,
+        "extra_frames": extra,
+        "mean_iou": mean(ious),
+        "min_iou": min(ious) if ious else None,
+        "mean_center_error_px": mean(center_errors),
+        "max_center_error_px": max(center_errors) if center_errors else None,
+        "mean_position_error_mm": mean([e for e in position_errors if math.isfinite(e)]),
+    }
+
+
+def evaluate(candidate_names, folders=DEFAULT_FOLDERS, golden_path=DEFAULT_GOLDEN_PATH, refresh_golden=False,
+             object_width_mm=DEFAULT_OBJECT_WIDTH_MM, focal_length=CAMERA_FOCAL_LENGTH_MM):
+    """
+    Evaluate candidate configurations against the reference detection path.
+
+    Args:
+        candidate_names (list): Names of entries in CANDIDATES
+        folders (list): Folders with evaluation frames
+        golden_path (str): Golden reference file
+        refresh_golden (bool): Rerun the reference path
+        object_width_mm (float): Real width of the object in millimeters
+        focal_length (float): Focal length in pixels
+
+    Returns:
+        dict: {'reference': latency summary, name: {accuracy + latency metrics}, ...}
+    """
+    paths = list_evaluation_files(folders)
+    if not paths:
+        print("No images found")
+        return {}
+
+    golden = load_or_create_golden(paths, golden_path, refresh_golden)
+    reference = [golden["frames"][p] for p in paths]
+    report = {"reference": golden["latency"]}
+
+    for name in candidate_names:
+        print(f"Running candidate {name}")
+        detections, latencies = run_timed(CANDIDATES[name], paths)
+        report[name] = compare_detections(reference, detections, object_width_mm, focal_length)
+        report[name].update(summarize_latency(latencies))
+        if name == "cascade":
+            report[name].update({f"cascade_{k}": v for k, v in get_cascade_stats().items()})
+    return report
+
+
+def print_report(report):
+    for name, metrics in report.items():
+        print(f"{name}:")
+        for key, value in metrics.items():
+            print(f"  {key}: {value:.4f}" if isinstance(value, float) else f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare fast inference modes against the reference detection path")
+    parser.add_argument("candidates", nargs="*", help=f"Candidate configurations to evaluate, any of {list(CANDIDATES)} (default: all)")
+    parser.add_argument("--folders", nargs="+", default=DEFAULT_FOLDERS, help="Folders with evaluation frames")
+    parser.add_argument("--golden", default=DEFAULT_GOLDEN_PATH, help="Golden reference file")
+    parser.add_argument("--refresh_golden", action="store_true", help="Rerun the reference path and overwrite the golden file")
+    parser.add_argument("--object_width_mm", type=float, default=DEFAULT_OBJECT_WIDTH_MM, help="Real object width in mm")
+    parser.add_argument("--output", help="Optional path to write the report as JSON")
+
+    args = parser.parse_args()
+    unknown = [name for name in args.candidates if name not in CANDIDATES]
+    if unknown:
+        parser.error(f"Unknown candidates: {unknown}")
+
+    report = evaluate(args.candidates or list(CANDIDATES), args.folders, args.golden, args.refresh_golden, args.object_width_mm)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
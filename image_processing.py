@@ -1,8 +1,15 @@
+import io
+import threading
+from collections import Counter
+from itertools import islice
+
 import torch
 from PIL import Image, ImageDraw, ImageFont
 
 from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
 
+from profiling import profile_model_forward
+
 # ---- Config ----
 MODEL_ID = "IDEA-Research/grounding-dino-base"  # common baseline checkpoint :contentReference[oaicite:1]{index=1}
 
@@ -13,6 +20,22 @@ TEXT_PROMPT = "drone."
 BOX_THRESHOLD = 0.25   # raise to reduce false positives
 TEXT_THRESHOLD = 0.25  # raise to be stricter about matching words
 
+# Grounding DINO's processor resizes so the shortest edge is 800 px, capped at 1333 px
+# for the longest edge. Frames are decoded no larger than needed to feed that resize.
+DETECTION_SHORTEST_EDGE = 800
+DETECTION_LONGEST_EDGE = 1333
+
+# Tiled mode for small, distant targets in high-resolution frames
+TILE_SIZE = 800          # tiles are fed to the model without downscaling
+TILE_OVERLAP = 0.25      # fraction of the tile shared with its neighbour
+TILE_NMS_IOU = 0.5       # boxes from overlapping tiles above this IoU are duplicates
+COARSE_THRESHOLD = 0.1   # low threshold for the full-frame pass that picks tiles
+
+# Cascade: a light checkpoint runs first; frames escalate to MODEL_ID when it is unsure
+LIGHT_MODEL_ID = "IDEA-Research/grounding-dino-tiny"
+CASCADE_SCORE_THRESHOLD = 0.4  # escalate when the light model's top score is below this
+CASCADE_TRACK_IOU = 0.1        # escalate when the light box overlaps the track less than this
+
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
 
@@ -40,42 +63,305 @@ def _get_text_size(draw, text, font):
     return (len(text) * 6, 11)
 
 
+def get_detection_size(width, height):
+    """
+    Compute the size the detector's processor will resize an image to.
+
+    Args:
+        width (int): Original image width in pixels
+        height (int): Original image height in pixels
+
+    Returns:
+        tuple: (width, height) in pixels
+    """
+    scale = min(DETECTION_SHORTEST_EDGE / min(width, height), DETECTION_LONGEST_EDGE / max(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def load_frame(fp, reduce=True, target_size=None):
+    """
+    Open an image, decoding JPEGs at reduced size when requested.
+
+    For JPEGs this uses DCT-domain scaling (PIL `draft`), which decodes at 1/2, 1/4 or
+    1/8 scale without ever materializing the full-size image. The original size is kept
+    in `image.info["original_size"]` so detections are reported in original-image pixels.
+
+    Args:
+        fp (str or file): Path or binary file object
+        reduce (bool): Decode at reduced size; pass False for full resolution (tiled mode)
+        target_size (tuple): (width, height) to decode at least to; defaults to the detector input size
+
+    Returns:
+        PIL.Image: RGB image, possibly smaller than the encoded one
+    """
+    image = Image.open(fp)
+    original_size = image.size
+    if reduce and image.format == "JPEG":
+        image.draft("RGB", target_size or get_detection_size(*original_size))
+    image = image.convert("RGB")
+    image.info["original_size"] = original_size
+    return image
+
+
+def decode_frame(img_bytes, reduce=True):
+    """
+    Decode an encoded frame directly at (roughly) the detector's input resolution.
+
+    Args:
+        img_bytes (bytes): Encoded image (JPEG, PNG, ...)
+        reduce (bool): Decode at reduced size; pass False for full resolution (tiled mode)
+
+    Returns:
+        PIL.Image: RGB image, possibly smaller than the encoded one
+    """
+    return load_frame(io.BytesIO(img_bytes), reduce)
+
 
-def get_object_bounding_box(images, text_prompt, processor, model):
-    top_detections = []
-    for image in images:
-        inputs = processor(images=image, text=text_prompt, return_tensors="pt").to(device)
+def get_original_size(image):
+    """Return the (width, height) the image had before any reduced decoding."""
+    return image.info.get("original_size", image.size)
 
-        with torch.no_grad():
+
+def _top_detection(detections):
+    """Return the single highest-scoring detection as a dict, or None if there are none."""
+    boxes = detections["boxes"]      # (N, 4) in xyxy
+    scores = detections["scores"]    # (N,)
+    labels = detections["labels"]    # list of strings
+
+    if len(boxes) == 0:
+        return None
+
+    scores_list = [float(s) for s in scores]
+    max_idx = int(max(range(len(scores_list)), key=lambda i: scores_list[i]))
+    return {
+        'label': labels[max_idx],
+        'score': scores_list[max_idx],
+        'box': boxes[max_idx].tolist()
+    }
+
+
+def _iter_raw_detections(images, text_prompt, processor, model, batch_size=1, threshold=BOX_THRESHOLD):
+    """
+    Run detection over an iterable of images, `batch_size` images per forward pass.
+
+    Yields the post-processed results for each image ({'boxes', 'scores', 'labels'}),
+    with boxes in original-image pixels.
+    """
+    images = iter(images)
+    while True:
+        batch = list(islice(images, batch_size))
+        if not batch:
+            return
+
+        inputs = processor(images=batch, text=[text_prompt] * len(batch), return_tensors="pt").to(device)
+
+        with torch.no_grad(), profile_model_forward():
             outputs = model(**inputs)
 
         results = processor.post_process_grounded_object_detection(
             outputs=outputs,
             input_ids=inputs["input_ids"],
-            threshold=BOX_THRESHOLD,
+            threshold=threshold,
             text_threshold=TEXT_THRESHOLD,
-            target_sizes=[image.size[::-1]]  # (height, width)
+            # Scale boxes to the original image, even if it was decoded at reduced size
+            target_sizes=[get_original_size(image)[::-1] for image in batch]  # (height, width)
         )
+        yield from results
+
+
+def _tile_origins(length, tile_size, overlap):
+    """Return tile start offsets covering [0, length) with the given overlap."""
+    if length <= tile_size:
+        return [0]
+    stride = max(1, int(tile_size * (1 - overlap)))
+    origins = list(range(0, length - tile_size, stride))
+    return origins + [length - tile_size]
+
+
+def _box_iou(boxes_a, boxes_b):
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy tensors."""
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    top_left = torch.max(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = torch.min(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = (bottom_right - top_left).clamp(min=0).prod(dim=2)
+    return inter / (area_a[:, None] + area_b[None, :] - inter).clamp(min=1e-6)
+
+
+def _nms(boxes, scores, iou_threshold):
+    """Greedy non-maximum suppression; returns kept indices, highest score first."""
+    order = scores.argsort(descending=True)
+    keep = []
+    while len(order) > 0:
+        best = order[0]
+        keep.append(int(best))
+        if len(order) == 1:
+            break
+        ious = _box_iou(boxes[best].unsqueeze(0), boxes[order[1:]])[0]
+        order = order[1:][ious <= iou_threshold]
+    return keep
+
+
+def detect_tiled(image, text_prompt, processor, model, batch_size=4, coarse_pass=True):
+    """
+    Detect objects by running the model on overlapping full-resolution tiles.
+
+    An optional coarse full-frame pass (with a low threshold) selects the tiles that
+    overlap a candidate; if it finds nothing, every tile is run. Tile boxes are shifted
+    back to frame coordinates and merged with cross-tile NMS.
+
+    Args:
+        image (PIL.Image): Frame, ideally decoded at full resolution
+        text_prompt (str): Text prompt for detection
+        batch_size (int): Number of tiles per model forward pass
+        coarse_pass (bool): Run a full-frame pass first to pick tiles
+
+    Returns:
+        dict: Merged detections {'boxes', 'scores', 'labels'} in original-image pixels
+    """
+    width, height = image.size
+    original_width, original_height = get_original_size(image)
+    to_original = torch.tensor([original_width / width, original_height / height] * 2)
+
+    tiles = [(x0, y0) for y0 in _tile_origins(height, TILE_SIZE, TILE_OVERLAP)
+             for x0 in _tile_origins(width, TILE_SIZE, TILE_OVERLAP)]
+
+    boxes, scores, labels = [], [], []
+    if coarse_pass:
+        coarse = next(_iter_raw_detections([image], text_prompt, processor, model, threshold=COARSE_THRESHOLD))
+        confident = coarse["scores"] >= BOX_THRESHOLD
+        boxes.append(coarse["boxes"][confident].cpu())
+        scores.append(coarse["scores"][confident].cpu())
+        labels.extend(label for label, keep in zip(coarse["labels"], confident.tolist()) if keep)
+
+        if len(coarse["boxes"]) > 0:
+            # Keep only tiles overlapping a candidate (in decoded-image pixels)
+            candidates = coarse["boxes"].cpu() / to_original
+            tiles = [(x0, y0) for x0, y0 in tiles
+                     if any(c[0] < x0 + TILE_SIZE and c[2] > x0 and c[1] < y0 + TILE_SIZE and c[3] > y0
+                            for c in candidates.tolist())]
+
+    def tile_images():
+        for x0, y0 in tiles:
+            tile = image.crop((x0, y0, min(x0 + TILE_SIZE, width), min(y0 + TILE_SIZE, height)))
+            tile.info["original_size"] = tile.size  # tile boxes stay in decoded pixels
+            yield tile
+
+    raw = _iter_raw_detections(tile_images(), text_prompt, processor, model, batch_size)
+    for (x0, y0), detections in zip(tiles, raw):
+        offset = torch.tensor([x0, y0, x0, y0], dtype=torch.float32)
+        boxes.append((detections["boxes"].cpu() + offset) * to_original)
+        scores.append(detections["scores"].cpu())
+        labels.extend(detections["labels"])
+
+    boxes = torch.cat(boxes) if boxes else torch.zeros((0, 4))
+    scores = torch.cat(scores) if scores else torch.zeros(0)
+    keep = _nms(boxes, scores, TILE_NMS_IOU)
+    return {
+        "boxes": boxes[keep].reshape(-1, 4),
+        "scores": scores[keep],
+        "labels": [labels[i] for i in keep],
+    }
+
+
+def iter_object_bounding_boxes(images, text_prompt, processor, model, batch_size=1, tiled=False):
+    """
+    Lazily run detection over an iterable of images, `batch_size` images per forward pass.
+
+    Yields one item per input image, in order, as soon as its batch finishes: either
+    None (no detection) or a dict {'label', 'score', 'box'} for the top detection.
+    With `tiled=True` each image goes through `detect_tiled` and `batch_size` applies to tiles.
+    """
+    if tiled:
+        for image in images:
+            yield _top_detection(detect_tiled(image, text_prompt, processor, model, batch_size))
+        return
+
+    # Return only the single detection with highest score (or None if no detections)
+    for detections in _iter_raw_detections(images, text_prompt, processor, model, batch_size):
+        yield _top_detection(detections)
+
+
+def get_object_bounding_box(images, text_prompt, processor, model, batch_size=1, tiled=False):
+    return list(iter_object_bounding_boxes(images, text_prompt, processor, model, batch_size, tiled))
+
+
+_light_lock = threading.Lock()
+_light_detector = None  # (processor, model) for LIGHT_MODEL_ID, loaded on first cascade use
+
+# Frames resolved by each cascade tier, updated from several inference threads
+cascade_stats = Counter()
+_cascade_stats_lock = threading.Lock()
+
+
+def get_light_detector():
+    """Return the (processor, model) of the light cascade tier, loading it once."""
+    global _light_detector
+    with _light_lock:
+        if _light_detector is None:
+            light_processor = AutoProcessor.from_pretrained(LIGHT_MODEL_ID)
+            light_model = AutoModelForZeroShotObjectDetection.from_pretrained(LIGHT_MODEL_ID).to(device)
+            _light_detector = (light_processor, light_model)
+        return _light_detector
+
+
+def get_cascade_stats():
+    """Per-tier hit counts: frames accepted from the light model vs escalated to the base model."""
+    with _cascade_stats_lock:
+        light, base = cascade_stats["light"], cascade_stats["base"]
+    total = light + base
+    return {
+        "light": light,
+        "base": base,
+        "light_ratio": light / total if total else None,
+    }
+
+
+def _needs_escalation(detection, track_box):
+    if detection is None or detection['score'] < CASCADE_SCORE_THRESHOLD:
+        return True
+    if track_box is None:
+        return False
+    iou = _box_iou(torch.tensor([detection['box']]), torch.tensor([track_box]))[0, 0]
+    return float(iou) < CASCADE_TRACK_IOU
+
+
+def iter_object_bounding_boxes_cascade(images, text_prompt, processor, model, batch_size=1, track_box=None):
+    """
+    Lazily run two-tier cascaded detection over an iterable of images.
+
+    Each batch goes through the light model first. A frame escalates to `model` (the
+    base checkpoint) when the light top score is below CASCADE_SCORE_THRESHOLD or its
+    box disagrees with the track (the last detection before the batch, seeded by
+    `track_box`). Yields one top detection (or None) per image, in order.
+    """
+    light_processor, light_model = get_light_detector()
+    images = iter(images)
+    while True:
+        batch = list(islice(images, batch_size))
+        if not batch:
+            return
+
+        light = _iter_raw_detections(batch, text_prompt, light_processor, light_model, batch_size)
+        detections = [_top_detection(d) for d in light]
+        escalate = [i for i, det in enumerate(detections) if _needs_escalation(det, track_box)]
+
+        base = _iter_raw_detections([batch[i] for i in escalate], text_prompt, processor, model, batch_size)
+        for i, d in zip(escalate, base):
+            detections[i] = _top_detection(d)
+
+        with _cascade_stats_lock:
+            cascade_stats["light"] += len(batch) - len(escalate)
+            cascade_stats["base"] += len(escalate)
+
+        for detection in detections:
+            if detection is not None:
+                track_box = detection['box']
+            yield detection
+
 
-        detections = results[0]
-        boxes = detections["boxes"]      # (N, 4) in xyxy
-        scores = detections["scores"]    # (N,)
-        labels = detections["labels"]    # list of strings
-
-        # Return only the single detection with highest score (or None if no detections)
-        if len(boxes) == 0:
-            top_detections.append(None)
-            continue
-
-        scores_list = [float(s) for s in scores]
-        max_idx = int(max(range(len(scores_list)), key=lambda i: scores_list[i]))
-        top_detections.append({
-            'label': labels[max_idx],
-            'score': scores_list[max_idx],
-            'box': boxes[max_idx].tolist()
-        })
-
-    return top_detections
+def get_object_bounding_box_cascade(images, text_prompt, processor, model, batch_size=1, track_box=None):
+    return list(iter_object_bounding_boxes_cascade(images, text_prompt, processor, model, batch_size, track_box))
 
 
 # images_paths_in_order = ['images/1.jpeg', 'images/2.jpeg', 'images/3.jpeg']
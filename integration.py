@@ -1,6 +1,10 @@
 # Integration script: Load images, detect objects, compute displacements
 
+import math
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from PIL import Image, ImageDraw, ImageFont
 import sys
 import time
@@ -9,48 +13,141 @@ from video_sampler import sample_video_frames
 
 # Import from image_processing
 sys.path.append('.')
-from image_processing import get_object_bounding_box, TEXT_PROMPT, processor, model
+from image_processing import get_object_bounding_box, get_object_bounding_box_cascade, iter_object_bounding_boxes, load_frame, get_original_size, TEXT_PROMPT, processor, model
+from camera_calibration import get_focal_length
 
 # Import from location_computing
-from location_computing import compute_distance_from_camera, compute_real_length, get_bounding_box_center, compute_center_displacements
+from location_computing import compute_distance_from_camera, compute_real_length, get_bounding_box_center, compute_center_displacements, CAMERA_FOCAL_LENGTH_MM
 
-CAMERA_FOCAL_LENGTH_MM = 1612.62
+# Run session frames through the light -> base detection cascade (see image_processing)
+USE_CASCADE = False
 
-def load_images_from_folder(folder_path):
+def list_image_files(folder_path):
+    """
+    List image file names in a folder, sorted by filename.
+
+    Args:
+        folder_path (str): Path to the folder containing images
+
+    Returns:
+        list: File names (not full paths)
+    """
+    return sorted([f for f in os.listdir(folder_path) if f.endswith(('.jpg', '.jpeg', '.png'))])
+
+def load_images_from_folder(folder_path, reduce=False, target_size=None, num_workers=4):
     """
     Load images from a folder, sorted by filename.
     
     Args:
         folder_path (str): Path to the folder containing images
+        reduce (bool): Decode JPEGs at reduced size (detections stay in original pixels)
+        target_size (tuple): (width, height) for reduced decoding; implies reduce
+        num_workers (int): Number of decoding threads
     
     Returns:
         list: List of PIL Images
     """
-    image_files = sorted([f for f in os.listdir(folder_path) if f.endswith(('.jpg', '.jpeg', '.png'))])
-    images = []
-    for img_file in image_files:
-        img_path = os.path.join(folder_path, img_file)
+    return list(iter_images_from_folder(folder_path, reduce, target_size, num_workers))
+
+def iter_images_from_folder(folder_path, reduce=False, target_size=None, num_workers=4, prefetch=8):
+    """
+    Lazily load images from a folder in filename order, decoding ahead on a thread pool.
+
+    At most `prefetch` decoded images are held at once, so memory stays constant and
+    decoding overlaps with detection when the result is passed straight to
+    `detect_objects_in_images` / `iter_object_bounding_boxes`.
+
+    Args:
+        folder_path (str): Path to the folder containing images
+        reduce (bool): Decode JPEGs at reduced size (detections stay in original pixels)
+        target_size (tuple): (width, height) for reduced decoding; implies reduce. With reduce
+            and no target size, the detector input size is used
+        num_workers (int): Number of decoding threads
+        prefetch (int): Maximum number of images decoded ahead
+
+    Yields:
+        PIL Image: RGB images
+    """
+    reduce = reduce or target_size is not None
+    files = iter(list_image_files(folder_path))
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
         try:
-            img = Image.open(img_path).convert("RGB")
-            images.append(img)
-        except Exception as e:
-            print(f"Error loading {img_file}: {e}")
-    return images
+            while True:
+                # Keep up to `prefetch` images decoding ahead of the consumer
+                for img_file in islice(files, max(1, prefetch) - len(pending)):
+                    img_path = os.path.join(folder_path, img_file)
+                    pending.append((img_file, executor.submit(load_frame, img_path, reduce, target_size)))
+                if not pending:
+                    return
 
-def detect_objects_in_images(images, text_prompt, processor, model):
+                img_file, future = pending.popleft()
+                try:
+                    img = future.result()
+                except Exception as e:
+                    print(f"Error loading {img_file}: {e}")
+                    continue
+                yield img
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+def detect_objects_in_images(images, text_prompt, processor, model, batch_size=1, cascade=False, track_box=None):
     """
     Run object detection on a list of images.
     
     Args:
         images (list): List of PIL Images
         text_prompt (str): Text prompt for detection
+        batch_size (int): Number of images per model forward pass
+        cascade (bool): Try the light model first and escalate unsure frames to `model`
+        track_box (list): Last known box [x1, y1, x2, y2]; cascade escalates on disagreement
     
     Returns:
         list: List of detections (dicts with 'label', 'score', 'box' or None)
     """
-    detections = get_object_bounding_box(images, text_prompt, processor, model)
+    if cascade:
+        return get_object_bounding_box_cascade(images, text_prompt, processor, model, batch_size, track_box)
+    detections = get_object_bounding_box(images, text_prompt, processor, model, batch_size)
     return detections
 
+def iter_detections_with_geometry(images, object_width_mm=None, batch_size=1, tiled=False, camera_profile=None):
+    """
+    Lazily detect objects in images and attach per-frame geometry.
+
+    Args:
+        images (iterable): PIL Images
+        object_width_mm (float): Real width of the object in mm; geometry is skipped if None
+        batch_size (int): Number of images (or tiles, when tiled) per model forward pass
+        tiled (bool): Use tiled detection for small objects in high-resolution frames
+        camera_profile (dict): Calibrated camera profile; defaults to CAMERA_FOCAL_LENGTH_MM
+
+    Yields:
+        dict: {'index', 'detection'} plus 'center' (px) and 'distance_mm' when geometry is requested
+    """
+    image_sizes = []
+
+    def track_sizes(images):
+        # The focal length of a profile depends on each frame's resolution
+        for image in images:
+            image_sizes.append(get_original_size(image))
+            yield image
+
+    detections = iter_object_bounding_boxes(track_sizes(images), TEXT_PROMPT, processor, model, batch_size, tiled)
+    for idx, detection in enumerate(detections):
+        result = {'index': idx, 'detection': detection}
+        if detection is not None and object_width_mm is not None:
+            try:
+                result['center'] = get_bounding_box_center(detection['box'])
+                focal_length = CAMERA_FOCAL_LENGTH_MM
+                if camera_profile is not None:
+                    focal_length = get_focal_length(camera_profile, image_sizes[idx])
+                distance_mm = compute_distance_from_camera(detection['box'], object_width_mm, focal_length)
+                result['distance_mm'] = distance_mm if math.isfinite(distance_mm) else None
+            except (ArithmeticError, TypeError, ValueError) as e:
+                result['error'] = f"Geometry failed: {e}"
+        yield result
+
 def compute_frame_displacements(detections, real_width, focal_length):
     """
     Compute displacements for each frame based on detections.
@@ -73,25 +170,29 @@ def compute_frame_displacements(detections, real_width, focal_length):
     displacements = compute_center_displacements(starting_center, detections, real_width, focal_length)
     return displacements
 
-def get_object_center(frame):
-    detection = detect_objects_in_images([frame], TEXT_PROMPT, processor, model)[0]
+def get_object_center(frame, return_detection=False):
+    detection = detect_objects_in_images([frame], TEXT_PROMPT, processor, model, cascade=USE_CASCADE)[0]
     if detection is None:
-        return None
+        return (None, None) if return_detection else None
     bbox = detection['box']
     center = get_bounding_box_center(bbox)
+    if return_detection:
+        return center, detection
     return center
 
 
-def get_updated_location(frame, starting_location, object_width_mm, starting_center=None):
+def get_updated_location(frame, starting_location, object_width_mm, starting_center=None, return_detection=False,
+                         focal_length=CAMERA_FOCAL_LENGTH_MM, track_box=None):
     start_time = time.time()
-    detection = detect_objects_in_images([frame], TEXT_PROMPT, processor, model)[0]
+    detection = detect_objects_in_images([frame], TEXT_PROMPT, processor, model,
+                                         cascade=USE_CASCADE, track_box=track_box)[0]
     elapsed = time.time() - start_time
     if detection is None:
-        return None
+        return (None, None) if return_detection else None
     
     bbox = detection['box']
     center = get_bounding_box_center(bbox)
-    distance_mm = compute_distance_from_camera(bbox, object_width_mm, CAMERA_FOCAL_LENGTH_MM)
+    distance_mm = compute_distance_from_camera(bbox, object_width_mm, focal_length)
     if starting_center is None:
         starting_center = center
         pixel_dx, pixel_dy = 0, 0
@@ -99,8 +200,8 @@ def get_updated_location(frame, starting_location, object_width_mm, starting_cen
     else:
         pixel_dx = center[0] - starting_center[0]
         pixel_dy = center[1] - starting_center[1]
-        dx = compute_real_length(pixel_dx, distance_mm, CAMERA_FOCAL_LENGTH_MM)
-        dy = compute_real_length(pixel_dy, distance_mm, CAMERA_FOCAL_LENGTH_MM)
+        dx = compute_real_length(pixel_dx, distance_mm, focal_length)
+        dy = compute_real_length(pixel_dy, distance_mm, focal_length)
 
     current_position = (starting_location[0] + dx, starting_location[1] + dy, distance_mm)
     print(f"Frame:")
@@ -110,6 +211,8 @@ def get_updated_location(frame, starting_location, object_width_mm, starting_cen
     print(f"  Displacement: ({dx:.2f}, {dy:.2f}) mm")
     print(f"  Position: ({current_position[0]:.2f}, {current_position[1]:.2f}, {distance_mm:.2f}) mm")
 
+    if return_detection:
+        return current_position, detection
     return current_position
 
 
@@ -1,7 +1,9 @@
 import math
 
 # Configuration for phone and camera
-CAMERA_FOCAL_LENGTH_MM = 1386  # Focal length of the camera in millimeters (adjust as needed)
+# Default focal length of the camera in pixels, used when no calibrated camera profile
+# is selected (see camera_calibration.py). Single source for the whole pipeline.
+CAMERA_FOCAL_LENGTH_MM = 1612.62
 
 def get_bounding_box_width_pixels(bbox):
     """
@@ -0,0 +1,185 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from uuid import uuid4
+
+import torch
+
+# Directory where each capture writes its traces (one sub-folder per capture)
+PROFILE_DIR = "profiles"
+SAMPLE_INTERVAL_S = 0.005  # Python stack sampler period
+
+_lock = threading.Lock()
+_forward_lock = threading.Lock()  # one torch.profiler session at a time
+_capture = None  # active ProfilingCapture, or None when profiling is off
+
+
+class ProfilingCapture:
+    """
+    One profiling capture, limited to a number of frames and/or a duration.
+
+    While active, every model forward is recorded with `torch.profiler` (one Chrome
+    trace per forward, exported off the inference thread) and a background thread
+    samples Python stacks of all other threads. On stop, the samples are written as
+    folded stacks for flamegraph tools.
+    """
+
+    def __init__(self, frames=None, seconds=None, directory=PROFILE_DIR):
+        self.capture_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid4().hex[:6]}"
+        self.output_dir = os.path.join(directory, self.capture_id)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self.frames_remaining = frames
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.forward_count = 0
+        self.stacks = Counter()
+        self._exports = []
+        self._stop_event = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_stacks, name="profiling-sampler", daemon=True)
+
+    def start(self):
+        self._sampler.start()
+
+    def expired(self):
+        if self.frames_remaining is not None and self.frames_remaining <= 0:
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def _sample_stacks(self):
+        own_ident = threading.get_ident()
+        names = {}
+        while not self._stop_event.wait(SAMPLE_INTERVAL_S):
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                stop_capture(self)
+                return
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """Stop sampling and write the folded stacks; returns the output directory."""
+        self._stop_event.set()
+        if self._sampler.is_alive() and self._sampler is not threading.current_thread():
+            self._sampler.join()
+        for export in list(self._exports):
+            export.join()
+        folded_path = os.path.join(self.output_dir, "python_stacks.folded")
+        with open(folded_path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Profiling capture {self.capture_id} saved to {self.output_dir}")
+        return self.output_dir
+
+    def export_trace(self, prof):
+        """Write a finished forward's Chrome trace in the background."""
+        with _lock:
+            self.forward_count += 1
+            path = os.path.join(self.output_dir, f"model_forward_{self.forward_count:04d}.json")
+        export = threading.Thread(target=prof.export_chrome_trace, args=(path,), name="profiling-export")
+        self._exports.append(export)
+        export.start()
+
+    def status(self):
+        return {
+            "capture_id": self.capture_id,
+            "output_dir": self.output_dir,
+            "frames_remaining": self.frames_remaining,
+            "seconds_remaining": None if self.deadline is None else max(0.0, self.deadline - time.monotonic()),
+            "forward_traces": self.forward_count,
+        }
+
+
+def start_capture(frames=None, seconds=None):
+    """
+    Start profiling the next `frames` frames and/or `seconds` seconds.
+
+    Args:
+        frames (int): Number of frames to profile, or None
+        seconds (float): Duration to profile, or None
+
+    Returns:
+        dict: Status of the new capture, or None if one is already running
+    """
+    global _capture
+    if frames is None and seconds is None:
+        raise ValueError("Either frames or seconds must be given")
+    with _lock:
+        if _capture is not None:
+            return None
+        _capture = ProfilingCapture(frames, seconds)
+        _capture.start()
+        return _capture.status()
+
+
+def stop_capture(expected=None, wait=False):
+    """
+    Stop the active capture (only if it is `expected`, when given) and return its output directory.
+
+    Profiling is off as soon as this returns. Joining the sampler and export threads and
+    writing the folded stacks happens on a background thread unless `wait` is True, so
+    callers on the event loop (frame_done, the admin endpoint) never block on it.
+    """
+    global _capture
+    with _lock:
+        if expected is not None and _capture is not expected:
+            return None
+        capture, _capture = _capture, None
+    if capture is None:
+        return None
+    if wait:
+        return capture.stop()
+    threading.Thread(target=capture.stop, name="profiling-stop").start()
+    return capture.output_dir
+
+
+def capture_status():
+    capture = _capture
+    return None if capture is None else capture.status()
+
+
+def frame_done():
+    """Count one processed frame against the active capture; a no-op when profiling is off."""
+    capture = _capture
+    if capture is None:
+        return
+    with _lock:
+        if capture.frames_remaining is not None:
+            capture.frames_remaining -= 1
+        expired = capture.expired()
+    if expired:
+        stop_capture(capture)
+
+
+@contextmanager
+def profile_model_forward():
+    """
+    Record the wrapped model forward with `torch.profiler` while a capture is active.
+
+    Profiled forwards are serialized so concurrent requests never open overlapping
+    profiler sessions; the trace is exported in the background after the forward.
+    """
+    capture = _capture
+    if capture is None:
+        yield
+        return
+
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    with _forward_lock:
+        with torch.profiler.profile(activities=activities, record_shapes=True, with_stack=True) as prof:
+            with torch.profiler.record_function("model_forward"):
+                yield
+    capture.export_trace(prof)
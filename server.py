@@ -1,67 +1,167 @@
+import asyncio
 import base64
-import io
+import binascii
+import json
 
-from PIL import Image
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 import uvicorn
 
-from api_functions import update_flying_session, open_flying_session
+from api_functions import update_flying_session, open_flying_session, close_flying_session, get_trajectory_store
+from camera_calibration import load_camera_profile
+from image_processing import decode_frame, get_cascade_stats
+from integration import iter_detections_with_geometry
 from location_computing import ecef_to_lla, tuple_multiply
+from profiling import start_capture, stop_capture, capture_status, frame_done
+from trajectory_store import record_to_dict
+
+DETECT_BATCH_SIZE = 4
+MAX_DETECT_BATCH_SIZE = 16  # upper bound for the /detect batch_size query parameter
+MAX_PENDING_FRAMES = 8  # frames queued on a websocket before the receive loop blocks
 
 app = FastAPI()
 archive = []
 
 
+def _process_frame(state, data):
+    """
+    Blocking per-frame work: decode the frame and open or update the flying session.
+
+    Args:
+        state (dict): Per-connection state ({'session_id'})
+        data (dict): Frame message received from the client
+
+    Returns:
+        dict: Result message fields ({'session_id', 'timestamp', 'position', 'score', 'session_opened'})
+    """
+    # 1. פענוח ה-Base64 לבייטים
+    img_base64 = data.get("frame")
+    img_bytes = base64.b64decode(img_base64)
+
+    # 2. המרה לאובייקט Pillow (פענוח ברזולוציה מופחתת לגודל הקלט של המודל)
+    image = decode_frame(img_bytes)
+
+    # 3. חילוץ נתוני המטא-דאטה
+    timestamp = data.get("timestamp")
+    drone_width_cm = data.get("drone_width_cm")
+    location = data.get("start_location")  # {lat: 32.1, lon: 34.8}
+    camera_profile = data.get("camera_profile")  # שם פרופיל מצלמה מכויל (camera_calibration.py)
+
+    print(f"Frame received at {timestamp} from {location}")
+    score = None
+    session_opened = False
+    if state["session_id"]:
+        print("Updating existing flying session")
+        processed_location, timestamp, detection = update_flying_session(
+            state["session_id"], image, timestamp, return_detection=True
+        )
+        print(f"Processed location: {processed_location} at timestamp {timestamp}")
+        archive.append({"location": processed_location, "timestamp": timestamp})
+        if detection is not None:
+            score = detection['score']
+    else:
+        print("Opening new flying session")
+        state["session_id"], start_center, detection = open_flying_session(
+            location, drone_width_cm, image, timestamp, camera_profile, return_detection=True
+        )
+        processed_location = location
+        session_opened = True
+        if detection is not None:
+            score = detection['score']
+        archive.append({"location": location, "timestamp": timestamp})
+        print(f"New flying session, Session ID: {state['session_id']}, Start Center: {start_center}")
+
+    return {
+        "session_id": state["session_id"],
+        "timestamp": timestamp,
+        "position": processed_location,
+        "score": score,
+        # The first frame opens the session: its position is the given start location
+        "session_opened": session_opened
+    }
+
+
+async def _process_frames(frames, outgoing):
+    """
+    Process queued frames in order, off the event loop, and queue their results.
+
+    When cancelled (client disconnected), waits for the frame already running in its
+    thread and then closes the connection's flying session.
+    """
+    state = {"session_id": None}
+    work = None
+    try:
+        while True:
+            seq, data = await frames.get()
+            work = asyncio.ensure_future(asyncio.to_thread(_process_frame, state, data))
+            try:
+                # Shielded so a disconnect does not abandon a frame mid-update
+                result = await asyncio.shield(work)
+                message = {"type": "result", "status": "success", "seq": seq, **result}
+            except Exception as e:
+                print(f"Error processing frame {seq}: {e}")
+                message = {"type": "result", "status": "error", "seq": seq,
+                           "timestamp": data.get("timestamp"), "error": str(e)}
+            frame_done()
+            await outgoing.put(message)
+    finally:
+        if work is not None and not work.done():
+            await asyncio.wait([work])
+        if state["session_id"]:
+            close_flying_session(state["session_id"])
+
+
+async def _send_messages(websocket, outgoing):
+    """Single writer for the socket: sends acks and results in the order they were queued."""
+    while True:
+        message = await outgoing.get()
+        await websocket.send_json(message)
+
+
 @app.websocket("/ws/stream")
 async def websocket_endpoint(websocket: WebSocket):
+    """
+    Pipelined frame stream.
+
+    Every frame is acked immediately with `{type: "ack", seq}` so the client can keep
+    sending; results `{type: "result", seq, timestamp, position, score, session_opened}` are pushed
+    independently as soon as each frame has been processed.
+    """
     global archive
     await websocket.accept()
+    archive = []
+    frames = asyncio.Queue(maxsize=MAX_PENDING_FRAMES)
+    outgoing = asyncio.Queue()
+    tasks = [
+        asyncio.create_task(_process_frames(frames, outgoing)),
+        asyncio.create_task(_send_messages(websocket, outgoing)),
+    ]
     try:
-        session_id = None
-        start_center = None
-        archive = []
+        seq = 0
         while True:
             # קבלת ה-JSON מהלקוח
             data = await websocket.receive_json()
 
-            # 1. פענוח ה-Base64 לבייטים
-            img_base64 = data.get("frame")
-            img_bytes = base64.b64decode(img_base64)
-
-            # 2. המרה לאובייקט Pillow
-            image = Image.open(io.BytesIO(img_bytes))
-
-            # 3. חילוץ נתוני המטא-דאטה
-            timestamp = data.get("timestamp")
-            drone_width_cm = data.get("drone_width_cm")
-            location = data.get("start_location")  # {lat: 32.1, lon: 34.8}
-
-            if image is not None:
-                # כאן יבוא עיבוד התמונה שלך
-                print(f"Frame received at {timestamp} from {location}")
-                if session_id:
-                    print("Updating existing flying session")
-                    processed_location, timestamp = update_flying_session(session_id, image, timestamp)
-                    print(f"Processed location: {processed_location} at timestamp {timestamp}")
-                    archive.append({"location": processed_location, "timestamp": timestamp})
-                else:
-                    print("Opening new flying session")
-                    session_id, start_center = open_flying_session(location, drone_width_cm, image)
-                    archive.append({"location": location, "timestamp": timestamp})
-                    print(f"New flying session, Session ID: {session_id}, Start Center: {start_center}")
-
-                
-
-                # החזרת תשובה ללקוח
-                await websocket.send_json({
-                    "status": "success",
-                    "received_at": timestamp
-                })
+            # Waits here when the server falls behind, which throttles the client
+            await frames.put((seq, data))
+
+            # החזרת אישור קבלה מיידי ללקוח
+            await outgoing.put({
+                "type": "ack",
+                "status": "success",
+                "seq": seq,
+                "received_at": data.get("timestamp")
+            })
+            seq += 1
 
     except WebSocketDisconnect:
         print("Client disconnected")
     except Exception as e:
         print(f"Error: {e}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 @app.get("/")
@@ -73,5 +173,126 @@ async def end_connection():
     return archive, 200
 
 
+async def _read_detect_payload(request):
+    """Return the encoded frames of a /detect request (JSON base64 or multipart JPEGs)."""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        return [await value.read() for _, value in form.multi_items() if hasattr(value, "read")]
+
+    # {"image": <base64>} as produced by base64_tojson.py, a list of those, or {"images": [...]}
+    payload = await request.json()
+    if isinstance(payload, dict):
+        payload = payload.get("images", [payload])
+    return [base64.b64decode(item["image"]) for item in payload]
+
+
+@app.post("/detect")
+async def detect(request: Request, drone_width_cm: float = None,
+                 batch_size: int = Query(DETECT_BATCH_SIZE, ge=1, le=MAX_DETECT_BATCH_SIZE),
+                 tiled: bool = False, camera_profile: str = None):
+    try:
+        profile = None if camera_profile is None else load_camera_profile(camera_profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        frames = await _read_detect_payload(request)
+    except (KeyError, TypeError, ValueError, binascii.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid detect payload: {e}")
+    if not frames:
+        raise HTTPException(status_code=400, detail="No images in request")
+
+    object_width_mm = None if drone_width_cm is None else drone_width_cm * 10  # Convert cm to mm
+    errors = {}            # request index -> error message
+    decoded_indices = []   # request index of each frame that reached the detector
+
+    def images():
+        for idx, img_bytes in enumerate(frames):
+            try:
+                # Tiled mode needs full-resolution frames to find small targets
+                image = decode_frame(img_bytes, reduce=not tiled)
+            except Exception as e:
+                errors[idx] = f"Could not decode image: {e}"
+                continue
+            decoded_indices.append(idx)
+            yield image
+
+    def error_lines(before):
+        for idx in sorted(i for i in errors if i < before):
+            frame_done()
+            yield json.dumps({"index": idx, "error": errors.pop(idx)}) + "\n"
+
+    def ndjson_lines():
+        # One JSON line per image, in request order, streamed as each batch completes
+        answered = set()
+        try:
+            for result in iter_detections_with_geometry(images(), object_width_mm, batch_size, tiled, profile):
+                result['index'] = decoded_indices[result['index']]
+                yield from error_lines(result['index'])
+                answered.add(result['index'])
+                frame_done()
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            # A failed forward pass cannot be attributed to one frame; report every unanswered one
+            print(f"Error in /detect: {e}")
+            for idx in range(len(frames)):
+                if idx not in answered:
+                    errors.setdefault(idx, f"Detection failed: {e}")
+        yield from error_lines(len(frames))
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@app.get("/admin/cascade")
+async def get_cascade_hits():
+    return get_cascade_stats()
+
+
+@app.post("/admin/profile")
+async def start_profiling(frames: int = None, seconds: float = None):
+    if frames is None and seconds is None:
+        raise HTTPException(status_code=400, detail="Give frames and/or seconds")
+    status = start_capture(frames, seconds)
+    if status is None:
+        raise HTTPException(status_code=409, detail="A profiling capture is already running")
+    return status
+
+
+@app.get("/admin/profile")
+async def get_profiling_status():
+    return {"active": capture_status()}
+
+
+@app.delete("/admin/profile")
+async def cancel_profiling():
+    output_dir = stop_capture()
+    if output_dir is None:
+        raise HTTPException(status_code=404, detail="No profiling capture is running")
+    return {"output_dir": output_dir}
+
+
+def _get_trajectory_or_404(session_id):
+    trajectory = get_trajectory_store(session_id)
+    if trajectory is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return trajectory
+
+
+@app.get("/sessions/{session_id}/trajectory")
+async def get_trajectory(session_id: str, start: float = None, end: float = None, max_points: int = None):
+    trajectory = _get_trajectory_or_404(session_id)
+    records = trajectory.query_range(start, end, max_points)
+    return {"session_id": session_id, "points": [record_to_dict(r) for r in records]}
+
+
+@app.get("/sessions/{session_id}/trajectory/at")
+async def get_trajectory_at(session_id: str, timestamp: float):
+    trajectory = _get_trajectory_or_404(session_id)
+    location = trajectory.interpolate(timestamp)
+    if location is None:
+        raise HTTPException(status_code=404, detail=f"Timestamp {timestamp} outside recorded range")
+    return {"session_id": session_id, "timestamp": timestamp, "location": location}
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,179 @@
+import math
+import os
+
+import numpy as np
+
+# Directory holding one append-only trajectory file per flying session
+TRAJECTORY_DIR = "trajectories"
+
+# Fixed-width record layout: one row per processed frame
+TRAJECTORY_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("x", "<f8"),
+    ("y", "<f8"),
+    ("z", "<f8"),
+    ("score", "<f4"),
+    ("box", "<f4", (4,)),
+])
+
+
+def _nan_to_none(value):
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def record_to_dict(record):
+    """
+    Convert a trajectory record to a JSON-serializable dict.
+
+    Args:
+        record (np.void): Single record of TRAJECTORY_DTYPE
+
+    Returns:
+        dict: {'timestamp', 'location', 'score', 'box'}
+    """
+    box = [_nan_to_none(v) for v in record["box"]]
+    return {
+        "timestamp": float(record["timestamp"]),
+        "location": tuple(_nan_to_none(record[k]) for k in ("x", "y", "z")),
+        "score": _nan_to_none(record["score"]),
+        "box": None if None in box else box,
+    }
+
+
+class TrajectoryStore:
+    """
+    Append-only, memory-mapped store of fixed-width trajectory records for one session.
+
+    Records are appended with a single write + fsync, so a crash can only leave a
+    partial trailing record, which is dropped the next time the store is opened.
+    Timestamps must be non-decreasing so time-range queries can binary search.
+
+    Read-only stores (for querying past sessions) hold no file descriptor; a writable
+    store keeps one open until `close()` (or the end of a `with` block).
+    """
+
+    def __init__(self, session_id, directory=TRAJECTORY_DIR, read_only=False):
+        self.session_id = session_id
+        self.path = os.path.join(directory, f"{session_id}.traj")
+        self._fd = None
+
+        if read_only:
+            # Ignore (but leave in place) a partial trailing record
+            self._count = os.path.getsize(self.path) // TRAJECTORY_DTYPE.itemsize
+            self._last_timestamp = float(self.records()["timestamp"][-1]) if self._count else None
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+
+        # Drop a partially written record left behind by a crash
+        size = os.fstat(self._fd).st_size
+        self._count = size // TRAJECTORY_DTYPE.itemsize
+        if size != self._count * TRAJECTORY_DTYPE.itemsize:
+            os.ftruncate(self._fd, self._count * TRAJECTORY_DTYPE.itemsize)
+            os.fsync(self._fd)
+
+        self._last_timestamp = float(self.records()["timestamp"][-1]) if self._count else None
+
+    @classmethod
+    def exists(cls, session_id, directory=TRAJECTORY_DIR):
+        return os.path.exists(os.path.join(directory, f"{session_id}.traj"))
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, timestamp, location, score=None, box=None):
+        """
+        Durably append one record.
+
+        Args:
+            timestamp (float): Frame timestamp, not earlier than the last appended one
+            location (tuple): (x, y, z) position
+            score (float): Detection score, or None
+            box (list): Bounding box [x1, y1, x2, y2] in pixels, or None
+        """
+        if self._fd is None:
+            raise ValueError(f"Trajectory store {self.session_id} is closed or read-only")
+        timestamp = float(timestamp)
+        if self._last_timestamp is not None and timestamp < self._last_timestamp:
+            raise ValueError(f"Out-of-order timestamp {timestamp} < {self._last_timestamp}")
+
+        record = np.zeros(1, dtype=TRAJECTORY_DTYPE)
+        record["timestamp"] = timestamp
+        record["x"], record["y"], record["z"] = (tuple(location) + (math.nan,) * 3)[:3]
+        record["score"] = math.nan if score is None else score
+        record["box"] = [math.nan] * 4 if box is None else box
+
+        os.write(self._fd, record.tobytes())
+        os.fsync(self._fd)
+        self._count += 1
+        self._last_timestamp = timestamp
+
+    def records(self):
+        """Return a read-only memory map over all complete records."""
+        if self._count == 0:
+            return np.zeros(0, dtype=TRAJECTORY_DTYPE)
+        return np.memmap(self.path, dtype=TRAJECTORY_DTYPE, mode="r", shape=(self._count,))
+
+    def query_range(self, start=None, end=None, max_points=None):
+        """
+        Return records with start <= timestamp <= end, optionally downsampled.
+
+        Args:
+            start (float): Inclusive lower bound, or None for the beginning
+            end (float): Inclusive upper bound, or None for the end
+            max_points (int): If set, keep at most this many evenly strided records
+
+        Returns:
+            np.ndarray: Records of TRAJECTORY_DTYPE
+        """
+        records = self.records()
+        timestamps = records["timestamp"]
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+        hi = len(records) if end is None else int(np.searchsorted(timestamps, end, side="right"))
+        selected = records[lo:hi]
+
+        if max_points is not None and len(selected) > max_points > 0:
+            stride = math.ceil(len(selected) / max_points)
+            selected = selected[::stride]
+        return np.array(selected)
+
+    def interpolate(self, timestamp):
+        """
+        Linearly interpolate the position at an arbitrary timestamp.
+
+        Args:
+            timestamp (float): Query timestamp
+
+        Returns:
+            tuple: (x, y, z), or None if the timestamp is outside the recorded range
+        """
+        records = self.records()
+        if len(records) == 0:
+            return None
+        timestamps = records["timestamp"]
+        if timestamp < timestamps[0] or timestamp > timestamps[-1]:
+            return None
+
+        # Only the two neighbouring records are needed
+        hi = int(np.searchsorted(timestamps, timestamp, side="left"))
+        if timestamps[hi] == timestamp:
+            before = after = records[hi]
+        else:
+            before, after = records[hi - 1], records[hi]
+
+        span = after["timestamp"] - before["timestamp"]
+        t = 0.0 if span == 0 else (timestamp - before["timestamp"]) / span
+        return tuple(_nan_to_none(before[k] + (after[k] - before[k]) * t) for k in ("x", "y", "z"))